@@ -1,16 +1,23 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request
-from fastapi.responses import Response
+from fastapi import FastAPI, APIRouter, HTTPException, Request, BackgroundTasks, Query
+from fastapi.responses import Response, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
 import os
 import logging
 from pathlib import Path
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
+import msgspec
 import uuid
 from datetime import datetime, timezone
 import json
+import asyncio
+import httpx
+from cachetools import TTLCache
 
 # Import OpenAI Realtime and LlmChat from emergentintegrations
 from emergentintegrations.llm.openai import OpenAIChatRealtime
@@ -21,26 +28,86 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    tz_aware=True,
+    maxPoolSize=200,
+    minPoolSize=20,
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=5000,
+    compressors="zstd"
+)
 db = client[os.environ['DB_NAME']]
 
 # Get API key
 api_key = os.environ.get('EMERGENT_LLM_KEY')
 
+# Await conversation writes before responding (set for durability-critical deployments)
+chat_sync_writes = os.environ.get('CHAT_SYNC_WRITES', 'false').lower() == 'true'
+
+# Conversation messages older than this are removed by a MongoDB TTL index
+conversation_ttl_days = int(os.environ.get('CONVERSATION_TTL_DAYS', '30'))
+
+# Cap in-flight Gemini calls; excess chats queue for up to llm_queue_timeout seconds
+llm_semaphore = asyncio.Semaphore(int(os.environ.get('LLM_MAX_CONCURRENCY', '32')))
+llm_queue_timeout = float(os.environ.get('LLM_QUEUE_TIMEOUT', '10'))
+
 # Initialize OpenAI Realtime for voice
 voice_chat = OpenAIChatRealtime(api_key=api_key)
 
+# Agent documents cached per worker; writes invalidate, other workers may be stale for up to the TTL
+agent_cache = TTLCache(maxsize=1024, ttl=30)
+# Only ids with a lookup in flight are tracked: invalidations bump their generation so a
+# lookup that raced a write does not re-cache the old document
+agent_lookups: Dict[str, int] = {}
+agent_generations: Dict[str, int] = {}
+
+# Startup and shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create indexes and the default order-taking agent, warm the agent cache, close Mongo on shutdown"""
+    await db.agents.create_index("id", unique=True)
+    await db.agents.create_index("name")
+    await db.llm_configs.create_index("id", unique=True)
+    await db.conversations.create_index([("session_id", 1), ("timestamp", 1)])
+    conversation_ttl = conversation_ttl_days * 24 * 3600
+    try:
+        await db.conversations.create_index("timestamp", expireAfterSeconds=conversation_ttl)
+    except OperationFailure as e:
+        # IndexOptionsConflict: CONVERSATION_TTL_DAYS changed since the index was built
+        if e.code != 85:
+            raise
+        await db.command("collMod", "conversations", index={"keyPattern": {"timestamp": 1}, "expireAfterSeconds": conversation_ttl})
+        logging.info("Conversation TTL updated to %s days", conversation_ttl_days)
+    
+    existing = await db.agents.find_one({"name": "Order Taking Agent"}, {"_id": 0})
+    if not existing:
+        order_agent = Agent(
+            name="Order Taking Agent",
+            description="Hindi voice bot for taking customer orders",
+            system_prompt="You are an order-taking voice bot that speaks in clear Hindi. Your job is to take orders from customers.\n\nInstructions:\n1. Always speak in clear and simple Hindi\n2. Let the customer speak - do not interrupt\n3. When customer says something, let them finish completely\n4. Listen patiently and understand\n5. Collect all information before confirming the order\n\nOrder taking process:\n1. Say Namaste and ask what they want to order\n2. Note the item name\n3. Ask for quantity\n4. Ask for delivery address\n5. Confirm contact number\n6. Repeat all order information\n7. Ask for confirmation\n\nRemember:\n- Speak in short sentences\n- Wait for customer response\n- Be polite and helpful\n- If you don't understand, ask again\n\nStart with: Namaste! Main aapke order mein madad karunga. Aap kya order karna chahte hain?",
+            language="hindi"
+        )
+        existing = order_agent.model_dump()
+        await db.agents.insert_one(dict(existing))
+        logging.info("Default order-taking agent created")
+    agent_cache[existing['id']] = existing
+    
+    yield
+    
+    client.close()
+
 # Create the main app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # Define Models
 class Agent(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+    model_config = ConfigDict(extra="ignore", frozen=True)
     
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     name: str
     description: str
     system_prompt: str
@@ -48,13 +115,25 @@ class Agent(BaseModel):
     is_active: bool = True
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
-class AgentCreate(BaseModel):
+class AgentSummary(BaseModel):
+    """Agent fields shown in list views; system_prompt is only returned by get_agent"""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    
+    id: str
+    name: str
+    description: str
+    language: str = "hindi"
+    is_active: bool = True
+    created_at: datetime
+
+# Request bodies are decoded with msgspec, which is much cheaper than Pydantic validation
+class AgentCreate(msgspec.Struct):
     name: str
     description: str
     system_prompt: str
     language: str = "hindi"
 
-class AgentUpdate(BaseModel):
+class AgentUpdate(msgspec.Struct):
     name: Optional[str] = None
     description: Optional[str] = None
     system_prompt: Optional[str] = None
@@ -62,84 +141,177 @@ class AgentUpdate(BaseModel):
     is_active: Optional[bool] = None
 
 class LLMConfig(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+    model_config = ConfigDict(extra="ignore", frozen=True)
     
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     provider: str  # openai, anthropic, gemini
     api_key: str
     model_name: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
-class LLMConfigCreate(BaseModel):
+class LLMConfigCreate(msgspec.Struct):
     provider: str
     api_key: str
     model_name: str
 
 class ConversationMessage(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+    model_config = ConfigDict(extra="ignore", frozen=True)
     
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     session_id: str
     agent_id: str
     role: str  # user or assistant
     content: str
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
-class ChatRequest(BaseModel):
+class ChatRequest(msgspec.Struct, frozen=True):
     agent_id: str
     message: str
     session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     response: str
     session_id: str
 
+class BatchSubRequest(msgspec.Struct):
+    id: str
+    url: str  # path relative to /api, e.g. /agents/{agent_id}
+    method: str = "GET"
+    body: Optional[Any] = None
+
+class BatchRequest(msgspec.Struct):
+    requests: List[BatchSubRequest]
+
+class BatchSubResponse(BaseModel):
+    id: str
+    status: int
+    body: Optional[Any] = None
+
+class BatchResponse(BaseModel):
+    responses: List[BatchSubResponse]
+
 # Register OpenAI Realtime router for voice
 OpenAIChatRealtime.register_openai_realtime_router(api_router, voice_chat)
 
+async def decode_body(raw_request: Request, body_type: type):
+    """Decode and validate a JSON request body with msgspec"""
+    try:
+        return msgspec.json.decode(await raw_request.body(), type=body_type)
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        # Keep FastAPI's list-of-errors detail shape for clients
+        error_type = "value_error" if isinstance(e, msgspec.ValidationError) else "json_invalid"
+        raise HTTPException(status_code=422, detail=[{"loc": ["body"], "msg": str(e), "type": error_type}])
+
+class AgentBatcher:
+    """Coalesces agent lookups issued within a short window into one $in query"""
+    
+    def __init__(self, max_wait: float = 0.002):
+        self.max_wait = max_wait
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+    
+    async def load(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        future = self.pending.get(agent_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[agent_id] = future
+            if self.flush_task is None:
+                self.flush_task = asyncio.create_task(self.flush())
+        # Shield so one cancelled caller does not cancel the lookup for the others
+        return await asyncio.shield(future)
+    
+    async def flush(self):
+        await asyncio.sleep(self.max_wait)
+        batch, self.pending, self.flush_task = self.pending, {}, None
+        try:
+            docs = await db.agents.find({"id": {"$in": list(batch)}}, {"_id": 0}).to_list(len(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        found = {doc['id']: doc for doc in docs}
+        for agent_id, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(agent_id))
+
+agent_batcher = AgentBatcher()
+
+async def fetch_agent(agent_id: str) -> Optional[Dict[str, Any]]:
+    """Get an agent document, served from the cache when possible"""
+    agent = agent_cache.get(agent_id)
+    if agent is None:
+        agent_lookups[agent_id] = agent_lookups.get(agent_id, 0) + 1
+        generation = agent_generations.get(agent_id, 0)
+        try:
+            agent = await agent_batcher.load(agent_id)
+        finally:
+            stale = agent_generations.get(agent_id, 0) != generation
+            remaining = agent_lookups.pop(agent_id) - 1
+            if remaining:
+                agent_lookups[agent_id] = remaining
+            else:
+                agent_generations.pop(agent_id, None)
+        if agent and not stale:
+            agent_cache[agent_id] = agent
+    return agent
+
+def invalidate_agent(agent_id: str):
+    """Drop a cached agent after it was written"""
+    if agent_id in agent_lookups:
+        agent_generations[agent_id] = agent_generations.get(agent_id, 0) + 1
+    agent_cache.pop(agent_id, None)
+
 # Agent Management Endpoints
 @api_router.post("/agents", response_model=Agent)
-async def create_agent(agent_data: AgentCreate):
+async def create_agent(raw_request: Request):
     """Create a new voice bot agent"""
-    agent = Agent(**agent_data.model_dump())
-    doc = agent.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    agent_data = await decode_body(raw_request, AgentCreate)
+    # Input is already validated, so build the document directly and skip revalidation
+    doc = msgspec.structs.asdict(agent_data)
+    doc['id'] = uuid.uuid4().hex
+    doc['is_active'] = True
+    doc['created_at'] = datetime.now(timezone.utc)
+    agent = Agent.model_construct(**doc)
     await db.agents.insert_one(doc)
     return agent
 
-@api_router.get("/agents", response_model=List[Agent])
-async def get_agents():
-    """Get all agents"""
-    agents = await db.agents.find({}, {"_id": 0}).to_list(1000)
-    for agent in agents:
-        if isinstance(agent['created_at'], str):
-            agent['created_at'] = datetime.fromisoformat(agent['created_at'])
+@api_router.get("/agents", response_model=List[AgentSummary])
+async def get_agents(skip: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=1000)):
+    """Get agents, paginated with skip/limit"""
+    cursor = db.agents.find({}, {"_id": 0, "system_prompt": 0}).sort("_id", 1).skip(skip).limit(limit)
+    agents = await cursor.to_list(length=limit)
     return agents
 
 @api_router.get("/agents/{agent_id}", response_model=Agent)
 async def get_agent(agent_id: str):
     """Get a specific agent by ID"""
-    agent = await db.agents.find_one({"id": agent_id}, {"_id": 0})
+    agent = await fetch_agent(agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
-    if isinstance(agent['created_at'], str):
-        agent['created_at'] = datetime.fromisoformat(agent['created_at'])
     return agent
 
 @api_router.put("/agents/{agent_id}", response_model=Agent)
-async def update_agent(agent_id: str, agent_update: AgentUpdate):
+async def update_agent(agent_id: str, raw_request: Request):
     """Update an agent"""
-    existing_agent = await db.agents.find_one({"id": agent_id}, {"_id": 0})
-    if not existing_agent:
-        raise HTTPException(status_code=404, detail="Agent not found")
-    
-    update_data = {k: v for k, v in agent_update.model_dump().items() if v is not None}
+    agent_update = await decode_body(raw_request, AgentUpdate)
+    update_data = {k: v for k, v in msgspec.structs.asdict(agent_update).items() if v is not None}
     if update_data:
-        await db.agents.update_one({"id": agent_id}, {"$set": update_data})
-    
-    updated_agent = await db.agents.find_one({"id": agent_id}, {"_id": 0})
-    if isinstance(updated_agent['created_at'], str):
-        updated_agent['created_at'] = datetime.fromisoformat(updated_agent['created_at'])
+        updated_agent = await db.agents.find_one_and_update(
+            {"id": agent_id},
+            {"$set": update_data},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_agent:
+            invalidate_agent(agent_id)
+    else:
+        updated_agent = await db.agents.find_one({"id": agent_id}, {"_id": 0})
+    if not updated_agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
     return updated_agent
 
 @api_router.delete("/agents/{agent_id}")
@@ -148,25 +320,26 @@ async def delete_agent(agent_id: str):
     result = await db.agents.delete_one({"id": agent_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Agent not found")
+    invalidate_agent(agent_id)
     return {"message": "Agent deleted successfully"}
 
 # LLM Configuration Endpoints
 @api_router.post("/llm-configs", response_model=LLMConfig)
-async def create_llm_config(config_data: LLMConfigCreate):
+async def create_llm_config(raw_request: Request):
     """Create LLM configuration"""
-    config = LLMConfig(**config_data.model_dump())
-    doc = config.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    config_data = await decode_body(raw_request, LLMConfigCreate)
+    doc = msgspec.structs.asdict(config_data)
+    doc['id'] = uuid.uuid4().hex
+    doc['created_at'] = datetime.now(timezone.utc)
+    config = LLMConfig.model_construct(**doc)
     await db.llm_configs.insert_one(doc)
     return config
 
 @api_router.get("/llm-configs", response_model=List[LLMConfig])
-async def get_llm_configs():
-    """Get all LLM configurations"""
-    configs = await db.llm_configs.find({}, {"_id": 0}).to_list(1000)
-    for config in configs:
-        if isinstance(config['created_at'], str):
-            config['created_at'] = datetime.fromisoformat(config['created_at'])
+async def get_llm_configs(skip: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=1000)):
+    """Get LLM configurations, paginated with skip/limit"""
+    cursor = db.llm_configs.find({}, {"_id": 0}).sort("_id", 1).skip(skip).limit(limit)
+    configs = await cursor.to_list(length=limit)
     return configs
 
 @api_router.delete("/llm-configs/{config_id}")
@@ -179,10 +352,12 @@ async def delete_llm_config(config_id: str):
 
 # Chat Endpoint (for text-based testing with Gemini)
 @api_router.post("/chat", response_model=ChatResponse)
-async def chat_with_agent(request: ChatRequest):
+async def chat_with_agent(raw_request: Request, background_tasks: BackgroundTasks):
     """Send a message to an agent using Gemini"""
+    request = await decode_body(raw_request, ChatRequest)
+    
     # Get agent details
-    agent = await db.agents.find_one({"id": request.agent_id}, {"_id": 0})
+    agent = await fetch_agent(request.agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
     
@@ -198,7 +373,14 @@ async def chat_with_agent(request: ChatRequest):
     
     # Send message
     user_message = UserMessage(text=request.message)
-    response = await gemini_chat.send_message(user_message)
+    try:
+        await asyncio.wait_for(llm_semaphore.acquire(), timeout=llm_queue_timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Chat is busy, please retry")
+    try:
+        response = await gemini_chat.send_message(user_message)
+    finally:
+        llm_semaphore.release()
     
     # Store conversation
     user_msg = ConversationMessage(
@@ -215,30 +397,64 @@ async def chat_with_agent(request: ChatRequest):
     )
     
     user_doc = user_msg.model_dump()
-    user_doc['timestamp'] = user_doc['timestamp'].isoformat()
     assistant_doc = assistant_msg.model_dump()
-    assistant_doc['timestamp'] = assistant_doc['timestamp'].isoformat()
     
-    await db.conversations.insert_many([user_doc, assistant_doc])
+    if chat_sync_writes:
+        await db.conversations.insert_many([user_doc, assistant_doc], ordered=False)
+    else:
+        background_tasks.add_task(db.conversations.insert_many, [user_doc, assistant_doc], ordered=False)
     
     return ChatResponse(response=response, session_id=session_id)
 
-# Initialize default order-taking agent
-@app.on_event("startup")
-async def startup_event():
-    """Create default order-taking agent if not exists"""
-    existing = await db.agents.find_one({"name": "Order Taking Agent"})
-    if not existing:
-        order_agent = Agent(
-            name="Order Taking Agent",
-            description="Hindi voice bot for taking customer orders",
-            system_prompt="You are an order-taking voice bot that speaks in clear Hindi. Your job is to take orders from customers.\n\nInstructions:\n1. Always speak in clear and simple Hindi\n2. Let the customer speak - do not interrupt\n3. When customer says something, let them finish completely\n4. Listen patiently and understand\n5. Collect all information before confirming the order\n\nOrder taking process:\n1. Say Namaste and ask what they want to order\n2. Note the item name\n3. Ask for quantity\n4. Ask for delivery address\n5. Confirm contact number\n6. Repeat all order information\n7. Ask for confirmation\n\nRemember:\n- Speak in short sentences\n- Wait for customer response\n- Be polite and helpful\n- If you don't understand, ask again\n\nStart with: Namaste! Main aapke order mein madad karunga. Aap kya order karna chahte hain?",
-            language="hindi"
+# Batch Endpoint (dispatches sub-requests in-process, without a network hop)
+MAX_BATCH_SIZE = 20
+BATCH_PATH = "/api/batch"
+BATCH_SUBREQUEST_HEADER = "X-Batch-Subrequest"
+
+async def dispatch_batch_request(http_client: httpx.AsyncClient, sub_request: BatchSubRequest) -> BatchSubResponse:
+    """Run a single batch sub-request against the app"""
+    url = "/" + sub_request.url.lstrip("/")
+    http_request = http_client.build_request(
+        sub_request.method.upper(),
+        url,
+        json=sub_request.body,
+        headers={BATCH_SUBREQUEST_HEADER: "1"}
+    )
+    # Check the path as the app will route it, after dot segments and percent-escapes are resolved
+    if http_request.url.path.rstrip("/") == BATCH_PATH:
+        return BatchSubResponse(id=sub_request.id, status=400, body={"detail": "Nested batch requests are not allowed"})
+    
+    response = await http_client.send(http_request)
+    try:
+        body = response.json() if response.content else None
+    except ValueError:
+        body = response.text
+    return BatchSubResponse(id=sub_request.id, status=response.status_code, body=body)
+
+@api_router.post("/batch", response_model=BatchResponse)
+async def batch(raw_request: Request):
+    """Execute multiple API requests in a single round trip"""
+    if raw_request.headers.get(BATCH_SUBREQUEST_HEADER):
+        raise HTTPException(status_code=400, detail="Nested batch requests are not allowed")
+    batch_request = await decode_body(raw_request, BatchRequest)
+    if len(batch_request.requests) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {MAX_BATCH_SIZE} requests")
+    
+    # Unhandled handler errors become per-item 500s instead of failing the whole batch
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://batch/api") as http_client:
+        results = await asyncio.gather(
+            *[dispatch_batch_request(http_client, r) for r in batch_request.requests],
+            return_exceptions=True
         )
-        doc = order_agent.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        await db.agents.insert_one(doc)
-        logging.info("Default order-taking agent created")
+    
+    responses = []
+    for sub_request, result in zip(batch_request.requests, results):
+        if isinstance(result, Exception):
+            logging.exception("Batch sub-request %s failed", sub_request.id, exc_info=result)
+            result = BatchSubResponse(id=sub_request.id, status=500, body={"detail": "Internal Server Error"})
+        responses.append(result)
+    return BatchResponse(responses=responses)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -257,7 +473,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -221,6 +221,50 @@ class VoiceBotAPITester:
         
         return success
 
+    def test_batch(self):
+        """Test POST /api/batch endpoint"""
+        name = "POST /api/batch - Batch requests"
+        batch_data = {
+            "requests": [
+                {"id": "list", "url": "/agents", "method": "GET"},
+                {"id": "missing", "url": "/agents/does-not-exist", "method": "GET"},
+                {"id": "nested", "url": "/./%62atch", "method": "POST", "body": {"requests": []}}
+            ]
+        }
+        
+        try:
+            response = requests.post(f"{self.base_url}/batch", json=batch_data, timeout=10)
+        except Exception as e:
+            self.log_result(name, False, f"Error: {str(e)}")
+            return False
+        
+        if response.status_code != 200:
+            self.log_result(name, False, f"Expected 200, got {response.status_code}. Response: {response.text[:200]}")
+            return False
+        
+        # Check sub-request statuses before logging, so the test is counted once
+        statuses = {r.get('id'): r.get('status') for r in response.json().get('responses', [])}
+        expected = {"list": 200, "missing": 404, "nested": 400}
+        success = statuses == expected
+        self.log_result(name, success, f"Sub-request statuses: {statuses}" if success else f"Expected {expected}, got {statuses}")
+        return success
+
+    def test_batch_limit(self):
+        """Test POST /api/batch rejects more than 20 sub-requests"""
+        batch_data = {
+            "requests": [{"id": str(i), "url": "/agents", "method": "GET"} for i in range(21)]
+        }
+        
+        success, response = self.run_test(
+            "POST /api/batch - Reject oversized batch",
+            "POST",
+            "batch",
+            400,
+            data=batch_data
+        )
+        
+        return success
+
     def print_summary(self):
         """Print test summary"""
         print("\n" + "="*60)
@@ -274,6 +318,12 @@ def main():
     print("-" * 60)
     tester.test_realtime_session()
     
+    # Test batch endpoint
+    print("\n📋 TESTING BATCH ENDPOINT")
+    print("-" * 60)
+    tester.test_batch()
+    tester.test_batch_limit()
+    
     # Test deleting agent
     print("\n📋 TESTING DELETE ENDPOINT")
     print("-" * 60)
@@ -12,6 +12,8 @@ import { Card, CardContent, CardHeader, CardTitle, CardDescription } from "@/com
 import { Mic, MicOff, PhoneCall, PhoneOff, MessageSquare } from "lucide-react";
 import { toast } from "sonner";
 
+const AGENTS_PAGE_SIZE = 100;
+
 const VoiceBotPage = ({ api }) => {
   const [agents, setAgents] = useState([]);
   const [selectedAgent, setSelectedAgent] = useState(null);
@@ -34,10 +36,18 @@ const VoiceBotPage = ({ api }) => {
 
   const fetchAgents = async () => {
     try {
-      const response = await axios.get(`${api}/agents`);
-      setAgents(response.data);
-      if (response.data.length > 0) {
-        setSelectedAgent(response.data[0].id);
+      // The agents endpoint is paginated, so keep fetching until a short page
+      const allAgents = [];
+      while (true) {
+        const response = await axios.get(`${api}/agents`, {
+          params: { skip: allAgents.length, limit: AGENTS_PAGE_SIZE },
+        });
+        allAgents.push(...response.data);
+        if (response.data.length < AGENTS_PAGE_SIZE) break;
+      }
+      setAgents(allAgents);
+      if (allAgents.length > 0) {
+        setSelectedAgent(allAgents[0].id);
       }
     } catch (error) {
       console.error("Error fetching agents:", error);